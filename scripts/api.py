@@ -1,19 +1,30 @@
 import os
+import asyncio
 import logging
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, HttpUrl
 from typing import List, Optional, Dict, Any
 import uvicorn
+import torch
 from dotenv import load_dotenv
-import tempfile
-import shutil
+import time
 import uuid
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from cachetools import TTLCache
 from datetime import datetime
 
 # Import our diagnosis function
-from diagnose import diagnose_plant_disease
+from diagnose import (
+    create_http_session,
+    diagnose_plant_disease,
+    disease_catalog,
+    get_batch_queue,
+    get_clip_model,
+    get_device
+)
 from supabase import create_client, Client
 
 # Configure logging
@@ -32,11 +43,42 @@ supabase: Client = create_client(
     os.getenv("SUPABASE_KEY", "")
 )
 
+# Each CPU worker holds its own ~1.7 GB FP32 model, so more workers are opt-in
+DEFAULT_CPU_WORKERS = 1
+
+# Set by __main__ to the worker count it launched; uvicorn --workers and gunicorn -w don't expose theirs
+LAUNCHED_WORKERS_ENV = "AGROVERSE_WORKERS"
+
+def get_worker_count() -> int:
+    """Return the number of uvicorn worker processes serving the app."""
+    return max(1, int(os.getenv(LAUNCHED_WORKERS_ENV, os.getenv("WEB_CONCURRENCY", 1))))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the CLIP model once at startup and share it across requests."""
+    device = get_device()
+    # Split the cores between workers instead of every worker's intra-op pool using all of them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // get_worker_count()))
+    app.state.clip_model = get_clip_model(device)
+    app.state.batch_queue = get_batch_queue(app.state.clip_model[0], device)
+    await app.state.batch_queue.warm_up()
+    app.state.batch_queue.start()
+    app.state.http = create_http_session()
+    try:
+        await asyncio.to_thread(disease_catalog.load)
+    except Exception as e:
+        logger.error(f"Error loading disease catalog: {str(e)}")
+    yield
+    await app.state.http.close()
+    await app.state.batch_queue.stop()
+
 # Create FastAPI app
 app = FastAPI(
     title="Agroverse Vision LLM API",
     description="API for plant disease diagnosis using vision models",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -76,19 +118,95 @@ async def root():
         "timestamp": datetime.now().isoformat()
     }
 
+# Background diagnosis jobs keyed by polling token
+_JOBS: TTLCache = TTLCache(maxsize=4096, ttl=3600)
+# Strong references to running job tasks, so evicting a job can't garbage collect its task
+_RUNNING_TASKS: set = set()
+# Background jobs allowed to run at once, so they can't exhaust memory or VRAM
+MAX_BACKGROUND_JOBS = 32
+# Poll delay hints in seconds, halved on every poll down to the minimum
+POLL_INITIAL_DELAY = 2.0
+POLL_MIN_DELAY = 0.25
+
+def _pending_response(token: str, polls: int) -> ORJSONResponse:
+    """Tell the client the job is still running and when to poll again."""
+    retry_after = max(POLL_MIN_DELAY, POLL_INITIAL_DELAY / (2 ** polls))
+    return ORJSONResponse(
+        status_code=202,
+        content={"token": token, "status": "pending", "retry_after": retry_after},
+        headers={"Retry-After": str(max(1, round(retry_after)))}
+    )
+
+def _require_background_slot() -> None:
+    """Reject background jobs that polls might not find or that would exceed the job cap."""
+    # Only __main__ knows how many workers it started; under any other server a poll
+    # could reach a worker that doesn't hold the job
+    if os.getenv(LAUNCHED_WORKERS_ENV) != "1":
+        raise HTTPException(
+            status_code=400,
+            detail="wait=false is only supported when started with `python scripts/api.py` on a single worker"
+        )
+    if len(_RUNNING_TASKS) >= MAX_BACKGROUND_JOBS:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many background diagnoses in progress",
+            headers={"Retry-After": str(round(POLL_INITIAL_DELAY))}
+        )
+
+def _start_job(coro) -> ORJSONResponse:
+    """Run a diagnosis in the background and return a token to poll for its result."""
+    token = str(uuid.uuid4())
+    task = asyncio.create_task(coro)
+    _RUNNING_TASKS.add(task)
+    task.add_done_callback(_RUNNING_TASKS.discard)
+    _JOBS[token] = {"task": task, "polls": 0}
+    return _pending_response(token, 0)
+
+async def _diagnose_url(image_url: str, top_k: int) -> Dict[str, Any]:
+    result = await diagnose_plant_disease(image_url, top_k, *app.state.clip_model, app.state.http)
+    
+    # Add timestamp
+    result["timestamp"] = datetime.now().isoformat()
+    
+    return result
+
+async def _store_upload(data: bytes, filename: str) -> None:
+    """Keep a copy of an uploaded image in Supabase Storage, logging rather than raising on failure."""
+    # Generate a unique filename
+    file_ext = os.path.splitext(filename)[1]
+    unique_filename = f"{uuid.uuid4()}{file_ext}"
+    file_path = f"diagnosis/{unique_filename}"
+    
+    try:
+        await asyncio.to_thread(supabase.storage.from_("images").upload, file_path, data)
+    except Exception as e:
+        logger.error(f"Error storing upload {file_path}: {str(e)}")
+
+async def _diagnose_upload(data: bytes, filename: str, top_k: int) -> Dict[str, Any]:
+    # The stored copy is only a record, so a failed upload doesn't discard the diagnosis
+    _, result = await asyncio.gather(
+        _store_upload(data, filename),
+        diagnose_plant_disease(data, top_k, *app.state.clip_model)
+    )
+    
+    # Add timestamp
+    result["timestamp"] = datetime.now().isoformat()
+    
+    return result
+
 @app.post("/diagnose", response_model=DiagnosisResponse)
-async def diagnose(request: DiagnosisRequest):
+async def diagnose(request: DiagnosisRequest, wait: bool = True):
     """
     Diagnose plant disease from an image URL
+    
+    With wait=false the response is a token to poll at GET /diagnose/{token}
     """
+    if not wait:
+        _require_background_slot()
+        return _start_job(_diagnose_url(str(request.image_url), request.top_k))
+    
     try:
-        # Call the diagnosis function
-        result = diagnose_plant_disease(str(request.image_url), request.top_k)
-        
-        # Add timestamp
-        result["timestamp"] = datetime.now().isoformat()
-        
-        return result
+        return await _diagnose_url(str(request.image_url), request.top_k)
     except Exception as e:
         logger.error(f"Error in diagnosis: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -97,65 +215,120 @@ async def diagnose(request: DiagnosisRequest):
 async def diagnose_upload(
     file: UploadFile = File(...),
     top_k: int = 5,
-    background_tasks: BackgroundTasks = BackgroundTasks()
+    wait: bool = True
 ):
     """
     Diagnose plant disease from an uploaded image
+    
+    With wait=false the response is a token to poll at GET /diagnose/{token}
     """
+    if not wait:
+        _require_background_slot()
+    
     try:
-        # Create a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
-            shutil.copyfileobj(file.file, temp_file)
-            temp_file_path = temp_file.name
-        
-        # Generate a unique filename
-        file_ext = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_ext}"
-        file_path = f"diagnosis/{unique_filename}"
-        
-        # Upload to Supabase Storage
-        with open(temp_file_path, "rb") as f:
-            supabase.storage.from_("images").upload(file_path, f)
+        data = await file.read()
+        if not wait:
+            return _start_job(_diagnose_upload(data, file.filename, top_k))
         
-        # Get public URL
-        public_url = supabase.storage.from_("images").get_public_url(file_path)
-        
-        # Clean up temp file
-        background_tasks.add_task(os.unlink, temp_file_path)
-        
-        # Call the diagnosis function
-        result = diagnose_plant_disease(public_url, top_k)
-        
-        # Add timestamp
-        result["timestamp"] = datetime.now().isoformat()
-        
-        return result
+        return await _diagnose_upload(data, file.filename, top_k)
     except Exception as e:
         logger.error(f"Error in diagnosis upload: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/diagnose/{token}")
+async def get_diagnosis(token: str):
+    """
+    Get the result of a background diagnosis
+    """
+    job = _JOBS.get(token)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Diagnosis not found")
+    
+    task = job["task"]
+    if not task.done():
+        job["polls"] += 1
+        return _pending_response(token, job["polls"])
+    
+    if task.exception() is not None:
+        logger.error(f"Error in background diagnosis {token}: {str(task.exception())}")
+        raise HTTPException(status_code=500, detail=str(task.exception()))
+    
+    return {**task.result(), "token": token, "status": "done"}
+
+# Seconds a cached page of the disease listing stays valid
+DISEASES_CACHE_TTL = 60
+
+@lru_cache(maxsize=16)
+def _fetch_diseases_page(limit: int, offset: int, ttl_bucket: int) -> Dict[str, Any]:
+    """Fetch one page of the disease index; ttl_bucket expires cached pages."""
+    result = supabase.table("disease_reference_images") \
+        .select("id, disease_name", count="exact") \
+        .order("disease_name") \
+        .order("id") \
+        .range(offset, offset + limit - 1) \
+        .execute()
+    
+    return {
+        "success": True,
+        "diseases": result.data,
+        "count": len(result.data),
+        "total": result.count
+    }
+
 @app.get("/diseases")
 async def get_diseases(limit: int = 100, offset: int = 0):
     """
-    Get a list of diseases from the database
+    Get a page of disease names from the database
     """
     try:
-        result = supabase.table("disease_reference_images") \
-            .select("id, disease_name, description, symptoms, recommendation, image_url, created_at") \
-            .order("disease_name") \
-            .range(offset, offset + limit - 1) \
-            .execute()
-        
-        return {
-            "success": True,
-            "diseases": result.data,
-            "count": len(result.data),
-            "total": result.count if hasattr(result, 'count') else len(result.data)
-        }
+        return await asyncio.to_thread(
+            _fetch_diseases_page, limit, offset, int(time.time() // DISEASES_CACHE_TTL)
+        )
     except Exception as e:
         logger.error(f"Error getting diseases: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/diseases/{disease_id}")
+async def get_disease(disease_id: uuid.UUID):
+    """
+    Get the full details of a single disease
+    """
+    try:
+        result = await asyncio.to_thread(
+            supabase.table("disease_reference_images")
+            .select("id, disease_name, description, symptoms, recommendation, image_url, created_at")
+            .eq("id", str(disease_id))
+            .execute
+        )
+    except Exception as e:
+        logger.error(f"Error getting disease {disease_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if not result.data:
+        raise HTTPException(status_code=404, detail="Disease not found")
+    
+    return {
+        "success": True,
+        "disease": result.data[0]
+    }
+
 # Run the app
 if __name__ == "__main__":
-    uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    # Each worker holds its own copy of the model, so with a GPU stay on one
+    # worker and let the micro-batcher share it across requests
+    if get_device() == "cuda":
+        workers = 1
+    else:
+        workers = int(os.getenv("WEB_CONCURRENCY", min(DEFAULT_CPU_WORKERS, os.cpu_count() or 1)))
+    # Workers read this back to size their torch thread pools and gate wait=false
+    os.environ[LAUNCHED_WORKERS_ENV] = str(workers)
+    
+    uvicorn.run(
+        "api:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", 8000)),
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
+        log_level="info"
+    ) 
\ No newline at end of file
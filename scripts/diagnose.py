@@ -1,15 +1,29 @@
 import os
+import copy
+import json
+import math
+import hashlib
+import time
+import asyncio
 import logging
+import threading
 import numpy as np
+import orjson
 import torch
 import clip
+from torch.nn.functional import normalize
+from torchvision import transforms
+from torchvision.io import ImageReadMode, decode_jpeg
 from PIL import Image
-import requests
+import aiohttp
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from supabase import create_client, Client
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Dict, List, Optional, Tuple, Any, Union
 from datetime import datetime
+from vector_search import quantize_rows, search_embeddings
 
 # Configure logging
 logging.basicConfig(
@@ -27,118 +41,415 @@ supabase: Client = create_client(
     os.getenv("SUPABASE_KEY", "")
 )
 
-def load_image_from_url(url: str) -> Optional[Image.Image]:
-    """Load an image from a URL."""
+# Loaded CLIP models keyed by device so the weights are only read once per worker
+_MODEL_CACHE: Dict[str, Tuple[Any, Any]] = {}
+_MODEL_LOCK = threading.Lock()
+
+def get_device() -> str:
+    """Return the torch device used for inference."""
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def get_clip_model(device: str) -> Tuple[Any, Any]:
+    """Load the CLIP model and preprocess transform, reusing them across calls."""
+    with _MODEL_LOCK:
+        if device not in _MODEL_CACHE:
+            logger.info(f"Loading CLIP model on {device}")
+            model, preprocess = clip.load("ViT-L/14", device=device)
+            model.eval()
+            # Half precision on GPU for tensor cores; the CPU path stays in FP32
+            if device == "cuda":
+                model = model.half()
+            # Fuse the visual encoder's kernels; the batch size varies with the micro-batcher
+            try:
+                model.visual = torch.compile(
+                    model.visual,
+                    mode="reduce-overhead" if device == "cuda" else "default",
+                    dynamic=True
+                )
+            except Exception as e:
+                logger.warning(f"torch.compile unavailable, using eager CLIP encoder: {str(e)}")
+            _MODEL_CACHE[device] = (model, preprocess)
+        return _MODEL_CACHE[device]
+
+# Micro-batching tunables for the shared CLIP encode queue
+MAX_BATCH_SIZE = 8
+MAX_WAIT_TIME = 0.02  # seconds
+
+class AsyncBatchQueue:
+    """Coalesce concurrent image encodes into batched CLIP forward passes."""
+
+    def __init__(self, model, device: str, max_batch_size: int = MAX_BATCH_SIZE, max_wait_time: float = MAX_WAIT_TIME):
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait_time = max_wait_time
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # CUDA graphs from reduce-overhead compilation are per thread, so every forward pass runs on one thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clip-encode")
+
+    def start(self) -> None:
+        """Start the batching task on the running event loop if it isn't already."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._task is not None and not self._task.done():
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._task = loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Cancel the batching task."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def warm_up(self) -> None:
+        """Run single-image and full batches through the model so compilation happens before the first request."""
+        loop = asyncio.get_running_loop()
+        for batch_size in sorted({1, self.max_batch_size}):
+            await loop.run_in_executor(
+                self._executor, self._encode_batch, [torch.zeros(3, 224, 224)] * batch_size
+            )
+
+    async def encode(self, image_input: torch.Tensor) -> torch.Tensor:
+        """Queue a single preprocessed image (C, H, W) and wait for its normalized features."""
+        self.start()
+        future = self._loop.create_future()
+        await self._queue.put((image_input, future))
+        return await future
+
+    async def _collect_batch(self) -> List[Tuple[torch.Tensor, asyncio.Future]]:
+        """Wait for one item, then gather more until the batch is full or the wait time runs out."""
+        items = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait_time
+        while len(items) < self.max_batch_size:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    def _forward(self, batch: torch.Tensor) -> torch.Tensor:
+        try:
+            return self.model.encode_image(batch)
+        except Exception as e:
+            # Compilation errors only surface when a shape is first run, fall back to eager mode
+            # and retry once so real runtime errors still propagate
+            if not hasattr(self.model.visual, "_orig_mod"):
+                raise
+            logger.warning(f"Compiled CLIP encoder failed, using eager mode: {str(e)}")
+            self.model.visual = self.model.visual._orig_mod
+            return self.model.encode_image(batch)
+
+    def _encode_batch(self, image_inputs: List[torch.Tensor]) -> torch.Tensor:
+        use_fp16 = self.device == "cuda"
+        dtype = torch.float16 if use_fp16 else torch.float32
+        # Inputs are already on the GPU when running on CUDA, see preprocess_image
+        batch = torch.stack([image_input.to(self.device, dtype=dtype) for image_input in image_inputs])
+        with torch.inference_mode():
+            with torch.autocast(device_type="cuda", dtype=torch.float16, enabled=use_fp16):
+                image_features = self._forward(batch)
+            # Normalize in FP32 to avoid FP16 underflow on the reciprocal
+            image_features = normalize(image_features.float(), dim=-1)
+        return image_features.cpu()
+
+    async def _run(self) -> None:
+        while True:
+            items = await self._collect_batch()
+            futures = [future for _, future in items]
+            try:
+                image_inputs = [image_input for image_input, _ in items]
+                # Run the forward pass off the event loop so new requests keep queueing
+                image_features = await self._loop.run_in_executor(self._executor, self._encode_batch, image_inputs)
+                for i, future in enumerate(futures):
+                    if not future.done():
+                        future.set_result(image_features[i])
+            except Exception as e:
+                logger.error(f"Error encoding batch of {len(items)} images: {str(e)}")
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+
+_BATCH_QUEUE: Optional[AsyncBatchQueue] = None
+
+def get_batch_queue(model, device: str) -> AsyncBatchQueue:
+    """Return the shared encode queue for a model, creating it on first use."""
+    global _BATCH_QUEUE
+    if _BATCH_QUEUE is None or _BATCH_QUEUE.model is not model:
+        _BATCH_QUEUE = AsyncBatchQueue(model, device)
+    return _BATCH_QUEUE
+
+def create_http_session() -> aiohttp.ClientSession:
+    """Create an HTTP session whose pooled keep-alive connections are reused for image downloads."""
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=64, limit_per_host=16),
+        timeout=aiohttp.ClientTimeout(total=15, sock_connect=3, sock_read=10)
+    )
+
+async def load_image_from_url(url: str, session: Optional[aiohttp.ClientSession] = None) -> Optional[bytes]:
+    """Download the raw bytes of an image from a URL."""
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return Image.open(BytesIO(response.content))
+        if session is None:
+            async with create_http_session() as session:
+                return await load_image_from_url(url, session)
+        async with session.get(url) as response:
+            response.raise_for_status()
+            return await response.read()
     except Exception as e:
         logger.error(f"Error loading image from URL {url}: {str(e)}")
         return None
 
-def generate_clip_embedding(image_url: str, model, preprocess, device: str) -> Optional[np.ndarray]:
-    """Generate CLIP embedding for an image."""
+# CLIP's normalization constants, for preprocessing decoded tensors on the GPU
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+_GPU_PREPROCESS = torch.nn.Sequential(
+    transforms.Resize(224, interpolation=transforms.InterpolationMode.BICUBIC, antialias=True),
+    transforms.CenterCrop(224),
+    transforms.ConvertImageDtype(torch.float16),
+    transforms.Normalize(mean=CLIP_MEAN, std=CLIP_STD)
+)
+
+# Per-thread CUDA streams for uploading CPU-preprocessed images
+_COPY_STREAMS = threading.local()
+
+def _upload_to_gpu(image_input: torch.Tensor, device: str) -> torch.Tensor:
+    """Copy a CPU tensor to the GPU from pinned memory on this thread's side stream."""
+    stream = getattr(_COPY_STREAMS, "stream", None)
+    if stream is None:
+        stream = _COPY_STREAMS.stream = torch.cuda.Stream()
+    pinned = image_input.to(torch.float16).pin_memory()
+    with torch.cuda.stream(stream):
+        gpu_input = pinned.to(device, non_blocking=True)
+    # Only this preprocessing thread waits; the encode thread's stream keeps running
+    stream.synchronize()
+    # The batch is encoded on the default stream, keep the memory from being reused under it
+    gpu_input.record_stream(torch.cuda.default_stream(device))
+    return gpu_input
+
+def preprocess_image(data: bytes, preprocess, device: str) -> torch.Tensor:
+    """Decode image bytes into a (3, 224, 224) model input, on the GPU when running on CUDA."""
+    # Decode JPEGs with NVJPEG and keep them on the GPU; other formats and CPU hosts use PIL
+    if device == "cuda" and data[:2] == b"\xff\xd8":
+        try:
+            image = decode_jpeg(
+                torch.frombuffer(bytearray(data), dtype=torch.uint8),
+                mode=ImageReadMode.RGB,
+                device=device
+            )
+            return _GPU_PREPROCESS(image)
+        except Exception as e:
+            logger.warning(f"GPU JPEG decode failed, falling back to PIL: {str(e)}")
+    image_input = preprocess(Image.open(BytesIO(data)))
+    if device == "cuda":
+        image_input = _upload_to_gpu(image_input, device)
+    return image_input
+
+async def generate_clip_embedding(data: bytes, batch_queue: AsyncBatchQueue, preprocess) -> Optional[np.ndarray]:
+    """Generate CLIP embedding for raw image bytes."""
     try:
-        # Load and preprocess image
-        image = load_image_from_url(image_url)
-        if image is None:
-            return None
-            
-        image_input = preprocess(image).unsqueeze(0).to(device)
+        # Decoding and resizing are CPU bound, keep them off the event loop
+        image_input = await asyncio.to_thread(preprocess_image, data, preprocess, batch_queue.device)
         
-        # Generate embedding
-        with torch.no_grad():
-            image_features = model.encode_image(image_input)
-            image_features /= image_features.norm(dim=-1, keepdim=True)
+        # Generate embedding as part of a shared batch
+        image_features = await batch_queue.encode(image_input)
             
-        # Convert to numpy array
-        embedding = image_features.cpu().numpy()[0]
-        
-        # Ensure 768 dimensions
-        if embedding.shape[0] != 768:
-            logger.warning(f"Embedding dimension mismatch. Expected 768, got {embedding.shape[0]}")
-            # Pad or truncate to 768 dimensions if necessary
-            if embedding.shape[0] < 768:
-                embedding = np.pad(embedding, (0, 768 - embedding.shape[0]))
-            else:
-                embedding = embedding[:768]
-                
-        return embedding
+        # Convert to numpy array (ViT-L/14 always yields 768 dimensions)
+        return image_features.numpy()
         
     except Exception as e:
-        logger.error(f"Error generating CLIP embedding for {image_url}: {str(e)}")
+        logger.error(f"Error generating CLIP embedding for {len(data)} byte image: {str(e)}")
         return None
 
-def find_similar_diseases(embedding, match_threshold=0.7, match_count=5):
+# Seconds before the in-memory disease catalog is reloaded from Supabase
+CATALOG_TTL = 300
+CATALOG_PAGE_SIZE = 1000
+# Backoff in seconds between failed catalog loads, doubling up to the maximum
+CATALOG_RETRY_BASE = 5
+CATALOG_RETRY_MAX = 300
+# Catalogs at least this large are stored as int8 with a per-row scale
+CATALOG_INT8_MIN_ROWS = 10000
+class DiseaseCatalog:
+    """In-memory copy of the disease reference table for local similarity search."""
+
+    def __init__(self, ttl: float = CATALOG_TTL):
+        self.ttl = ttl
+        self.E = np.zeros((0, 768), dtype=np.float32)
+        self.inv_scale: Optional[np.ndarray] = None
+        self.meta: List[Dict[str, Any]] = []
+        self.loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._failures = 0
+        self._retry_at = 0.0
+
+    def load(self) -> None:
+        """Fetch every disease with an embedding and stack the embeddings into one matrix."""
+        rows = []
+        offset = 0
+        while True:
+            result = supabase.table("disease_reference_images") \
+                .select("id, disease_name, description, symptoms, recommendation, image_url, embedding") \
+                .order("id") \
+                .range(offset, offset + CATALOG_PAGE_SIZE - 1) \
+                .execute()
+            rows.extend(result.data)
+            if len(result.data) < CATALOG_PAGE_SIZE:
+                break
+            offset += CATALOG_PAGE_SIZE
+
+        embeddings = []
+        meta = []
+        for row in rows:
+            embedding = row.pop("embedding", None)
+            if not embedding:
+                continue
+            # PostgREST returns pgvector columns as their text representation
+            if isinstance(embedding, str):
+                embedding = json.loads(embedding)
+            embeddings.append(embedding)
+            row["_symptom_tokens"] = process_symptoms(row.get("symptoms") or "")
+            meta.append(row)
+
+        E = np.asarray(embeddings, dtype=np.float32).reshape(-1, 768)
+        norms = np.linalg.norm(E, axis=1, keepdims=True)
+        E /= np.where(norms > 0, norms, 1.0)
+        inv_scale = None
+        if len(E) >= CATALOG_INT8_MIN_ROWS:
+            E, inv_scale = quantize_rows(E)
+
+        with self._lock:
+            self.E = E
+            self.inv_scale = inv_scale
+            self.meta = meta
+            self.loaded_at = time.monotonic()
+        logger.info(f"Loaded {len(meta)} diseases into the catalog")
+
+    def _reload(self) -> None:
+        try:
+            self.load()
+            self._failures = 0
+        except Exception as e:
+            delay = min(CATALOG_RETRY_MAX, CATALOG_RETRY_BASE * 2 ** self._failures)
+            self._failures += 1
+            self._retry_at = time.monotonic() + delay
+            logger.error(f"Error reloading disease catalog, retrying in {delay}s: {str(e)}")
+        finally:
+            self._refreshing = False
+
+    def refresh_if_stale(self) -> None:
+        """Load the catalog in a background thread if it is missing or stale, backing off after failures."""
+        now = time.monotonic()
+        if self._refreshing or now < self._retry_at:
+            return
+        if self.loaded_at is None or now - self.loaded_at > self.ttl:
+            self._refreshing = True
+            threading.Thread(target=self._reload, daemon=True).start()
+
+    def search(self, query_embedding: np.ndarray, match_threshold: float, match_count: int) -> List[Dict[str, Any]]:
+        """Return the closest diseases above the threshold, most similar first."""
+        with self._lock:
+            E, inv_scale, meta = self.E, self.inv_scale, self.meta
+        if not meta:
+            return []
+
+        return [
+            {**meta[i], "similarity": similarity}
+            for i, similarity in search_embeddings(E, inv_scale, query_embedding, match_threshold, match_count)
+        ]
+
+disease_catalog = DiseaseCatalog()
+
+def to_pgvector_literal(embedding: np.ndarray) -> str:
+    """Serialize an embedding to pgvector's text format ("[x,y,...]") in one native call."""
+    return orjson.dumps(embedding.astype(np.float32), option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+async def find_similar_diseases(embedding, match_threshold=0.7, match_count=5):
     try:
-        result = supabase.rpc(
-            'match_disease_images',
-            {
-                'query_embedding': embedding.tolist(),
-                'match_threshold': match_threshold,
-                'match_count': match_count
-            }
-        ).execute()
+        disease_catalog.refresh_if_stale()
+        if disease_catalog.meta:
+            return disease_catalog.search(embedding, match_threshold, match_count)
+    except Exception as e:
+        logger.error(f"Error searching disease catalog, falling back to RPC: {str(e)}")
+
+    try:
+        # The catalog isn't loaded yet, search server side without blocking the event loop
+        result = await asyncio.to_thread(
+            supabase.rpc(
+                'match_disease_images',
+                {
+                    'query_embedding': to_pgvector_literal(embedding),
+                    'match_threshold': match_threshold,
+                    'match_count': match_count
+                }
+            ).execute
+        )
         return result.data
     except Exception as e:
-        print(f"Error finding similar diseases: {e}")
+        logger.error(f"Error finding similar diseases: {str(e)}")
         return []
 
-def calculate_symptom_overlap(primary_symptoms: str, alternative_symptoms: str) -> float:
-    """Calculate symptom overlap score between two symptom descriptions."""
-    if not primary_symptoms or not alternative_symptoms:
-        return 0.0
-    
-    # Convert symptoms strings to sets of words for comparison
-    # Remove common words and punctuation for better matching
-    common_words = {'and', 'or', 'the', 'in', 'on', 'at', 'to', 'of', 'with', 'may', 'can'}
-    
-    def process_symptoms(symptoms: str) -> set:
-        words = set(symptoms.lower().replace(',', ' ').replace('.', ' ').split())
-        return words - common_words
-    
-    primary_set = process_symptoms(primary_symptoms)
-    alternative_set = process_symptoms(alternative_symptoms)
-    
-    if not primary_set or not alternative_set:
-        return 0.0
-    
+# Common words and punctuation removed from symptoms for better matching
+_STOPWORDS = frozenset({'and', 'or', 'the', 'in', 'on', 'at', 'to', 'of', 'with', 'may', 'can'})
+_PUNCT_TABLE = str.maketrans(",.;:!?", "      ")
+
+def process_symptoms(symptoms: str) -> frozenset:
+    """Convert a symptom description into a set of words for comparison."""
+    return frozenset(symptoms.lower().translate(_PUNCT_TABLE).split()) - _STOPWORDS
+
+def get_symptom_tokens(disease: Dict[str, Any]) -> frozenset:
+    """Return the symptom tokens precomputed by the catalog, building them if missing."""
+    tokens = disease.get("_symptom_tokens")
+    if tokens is None:
+        tokens = process_symptoms(disease.get("symptoms") or "")
+    return tokens
+
+def calculate_symptom_overlap(primary_tokens: frozenset, alternative_tokens: frozenset) -> float:
+    """Calculate symptom overlap score between two symptom token sets."""
     # Calculate Jaccard similarity for symptom overlap
-    overlap = len(primary_set.intersection(alternative_set))
-    total = len(primary_set.union(alternative_set))
+    overlap = len(primary_tokens & alternative_tokens)
+    total = len(primary_tokens | alternative_tokens)
     
     return overlap / total if total > 0 else 0.0
 
+# Define seasonal patterns for diseases (example mapping)
+# You might want to move this to a database or configuration file
+SEASONAL_PATTERNS = {
+    "bacterial spot": {"peak_months": [6, 7, 8], "moderate_months": [5, 9]},  # Summer disease
+    "early blight": {"peak_months": [7, 8], "moderate_months": [6, 9]},      # Late summer
+    "late blight": {"peak_months": [8, 9], "moderate_months": [7, 10]},      # Late summer/early fall
+    "leaf mold": {"peak_months": [6, 7, 8, 9], "moderate_months": [5, 10]},  # Warm and humid months
+    "septoria leaf spot": {"peak_months": [7, 8], "moderate_months": [6, 9]} # Mid-summer
+    # Add more diseases and their seasonal patterns
+}
+
+def _build_seasonal_scores() -> Dict[str, np.ndarray]:
+    """Precompute a relevance score per month (indexed 1-12) for each disease."""
+    scores_by_disease = {}
+    for disease_name, pattern in SEASONAL_PATTERNS.items():
+        scores = np.full(13, 0.3)
+        scores[pattern["moderate_months"]] = 0.7
+        scores[pattern["peak_months"]] = 1.0
+        scores_by_disease[disease_name] = scores
+    return scores_by_disease
+
+_SEASONAL = _build_seasonal_scores()
+# Default to moderate relevance if pattern unknown
+_DEFAULT_SEASONAL_SCORES = np.full(13, 0.5)
+
 def calculate_seasonal_relevance(disease_name: str) -> float:
     """Calculate how relevant a disease is for the current season."""
     # Get current month (1-12)
     current_month = datetime.now().month
-    
-    # Define seasonal patterns for diseases (example mapping)
-    # You might want to move this to a database or configuration file
-    seasonal_patterns = {
-        "bacterial spot": {"peak_months": [6, 7, 8], "moderate_months": [5, 9]},  # Summer disease
-        "early blight": {"peak_months": [7, 8], "moderate_months": [6, 9]},      # Late summer
-        "late blight": {"peak_months": [8, 9], "moderate_months": [7, 10]},      # Late summer/early fall
-        "leaf mold": {"peak_months": [6, 7, 8, 9], "moderate_months": [5, 10]},  # Warm and humid months
-        "septoria leaf spot": {"peak_months": [7, 8], "moderate_months": [6, 9]} # Mid-summer
-        # Add more diseases and their seasonal patterns
-    }
-    
-    # Default to moderate relevance if pattern unknown
-    if disease_name.lower() not in seasonal_patterns:
-        return 0.5
-    
-    pattern = seasonal_patterns[disease_name.lower()]
-    
-    # Calculate relevance based on current month
-    if current_month in pattern["peak_months"]:
-        return 1.0
-    elif current_month in pattern["moderate_months"]:
-        return 0.7
-    else:
-        return 0.3
+    return float(_SEASONAL.get(disease_name.lower(), _DEFAULT_SEASONAL_SCORES)[current_month])
 
 def calculate_confidence_metrics(similar_diseases: List[Dict[str, Any]]) -> Dict[str, Any]:
     """Calculate additional confidence metrics for the diagnosis."""
@@ -146,8 +457,12 @@ def calculate_confidence_metrics(similar_diseases: List[Dict[str, Any]]) -> Dict
         return {}
     
     # Get all confidence scores
-    confidences = [d.get("similarity", 0.0) for d in similar_diseases]
-    primary_confidence = confidences[0]
+    confidences = np.fromiter(
+        (d.get("similarity", 0.0) for d in similar_diseases),
+        dtype=np.float64,
+        count=len(similar_diseases)
+    )
+    primary_confidence = float(confidences[0])
     
     # Calculate basic metrics
     metrics = {
@@ -161,16 +476,17 @@ def calculate_confidence_metrics(similar_diseases: List[Dict[str, Any]]) -> Dict
     
     if len(confidences) > 1:
         # Calculate existing metrics
-        metrics["relative_confidence"] = primary_confidence / confidences[1] if confidences[1] > 0 else float('inf')
-        metrics["confidence_margin"] = primary_confidence - confidences[1]
+        second_confidence = float(confidences[1])
+        metrics["relative_confidence"] = primary_confidence / second_confidence if second_confidence > 0 else math.inf
+        metrics["confidence_margin"] = primary_confidence - second_confidence
         
-        avg_other_confidence = sum(confidences[1:]) / len(confidences[1:])
+        avg_other_confidence = float(confidences[1:].mean())
         metrics["diagnosis_clarity"] = (primary_confidence - avg_other_confidence) / primary_confidence if primary_confidence > 0 else 0.0
         
         # Calculate symptom overlap with alternatives
-        primary_symptoms = similar_diseases[0].get("symptoms", "")
+        primary_tokens = get_symptom_tokens(similar_diseases[0])
         for disease in similar_diseases[1:]:
-            overlap = calculate_symptom_overlap(primary_symptoms, disease.get("symptoms", ""))
+            overlap = calculate_symptom_overlap(primary_tokens, get_symptom_tokens(disease))
             metrics["symptom_overlap"].append({
                 "disease": disease.get("disease_name", "Unknown"),
                 "overlap_score": overlap
@@ -181,23 +497,35 @@ def calculate_confidence_metrics(similar_diseases: List[Dict[str, Any]]) -> Dict
     
     return metrics
 
-def diagnose_plant_disease(image_url: str, top_k: int = 5) -> Dict[str, Any]:
+# Successful diagnoses keyed by (image content hash, top_k, catalog load time)
+_DIAG_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=3600)
+
+async def diagnose_plant_disease(
+    image: Union[str, bytes],
+    top_k: int = 5,
+    model=None,
+    preprocess=None,
+    session: Optional[aiohttp.ClientSession] = None
+) -> Dict[str, Any]:
     """
-    Diagnose plant disease from an image URL.
+    Diagnose plant disease from an image URL or raw image bytes.
     
     Args:
-        image_url: URL of the plant image to diagnose
+        image: URL of the plant image to diagnose, or the raw image bytes
         top_k: Number of similar diseases to return
+        model: Preloaded CLIP model (loaded and cached if not given)
+        preprocess: Preprocess transform matching the model
+        session: Shared HTTP session for downloading the image
         
     Returns:
         Dictionary containing diagnosis results
     """
     # Load CLIP model
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    logger.info(f"Using device: {device}")
+    device = get_device()
     
     try:
-        model, preprocess = clip.load("ViT-L/14", device=device)
+        if model is None or preprocess is None:
+            model, preprocess = get_clip_model(device)
     except Exception as e:
         logger.error(f"Error loading CLIP model: {str(e)}")
         return {
@@ -206,8 +534,22 @@ def diagnose_plant_disease(image_url: str, top_k: int = 5) -> Dict[str, Any]:
             "details": str(e)
         }
     
+    # Load image bytes and reuse the result for an identical image
+    data = image if isinstance(image, bytes) else await load_image_from_url(image, session)
+    if data is None:
+        return {
+            "success": False,
+            "error": "Failed to generate image embedding"
+        }
+    
+    # Including the catalog load time drops cached results once the catalog reloads
+    cache_key = (hashlib.blake2b(data, digest_size=16).digest(), top_k, disease_catalog.loaded_at)
+    cached = _DIAG_CACHE.get(cache_key)
+    if cached is not None:
+        return copy.deepcopy(cached)
+    
     # Generate embedding
-    embedding = generate_clip_embedding(image_url, model, preprocess, device)
+    embedding = await generate_clip_embedding(data, get_batch_queue(model, device), preprocess)
     if embedding is None:
         return {
             "success": False,
@@ -215,7 +557,7 @@ def diagnose_plant_disease(image_url: str, top_k: int = 5) -> Dict[str, Any]:
         }
     
     # Find similar diseases
-    similar_diseases = find_similar_diseases(embedding, 0.7, top_k)
+    similar_diseases = await find_similar_diseases(embedding, 0.7, top_k)
     
     if not similar_diseases:
         return {
@@ -253,6 +595,8 @@ def diagnose_plant_disease(image_url: str, top_k: int = 5) -> Dict[str, Any]:
         ]
     }
     
+    _DIAG_CACHE[cache_key] = copy.deepcopy(results)
+    
     return results
 
 # Example usage
@@ -261,7 +605,7 @@ if __name__ == "__main__":
     test_image_url = "https://example.com/plant_disease.jpg"
     
     # Run diagnosis
-    result = diagnose_plant_disease(test_image_url)
+    result = asyncio.run(diagnose_plant_disease(test_image_url))
     
     # Print results
     if result["success"]:
@@ -1,4 +1,5 @@
 import os
+import asyncio
 import logging
 import json
 from dotenv import load_dotenv
@@ -104,7 +105,7 @@ def test_diagnosis():
         logger.info(f"Expected disease: {test_case['expected_disease']}")
         
         # Get diagnosis
-        result = diagnose_plant_disease(test_case['url'])
+        result = asyncio.run(diagnose_plant_disease(test_case['url']))
         
         if result['success']:
             diagnosis = result['diagnosis']
@@ -0,0 +1,75 @@
+import numpy as np
+from vector_search import quantize_rows, score_int8_rows, search_embeddings
+
+def _normalized_rows(n: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    E = rng.standard_normal((n, 768)).astype(np.float32)
+    return E / np.linalg.norm(E, axis=1, keepdims=True)
+
+def test_int8_scores_match_float32():
+    """Quantized scores stay close to the exact dot products and keep the top-k order."""
+    E = _normalized_rows(2000)
+    rng = np.random.default_rng(1)
+    query = rng.standard_normal(768).astype(np.float32)
+    query /= np.linalg.norm(query)
+
+    # Plant rows with known similarities to the query, as close matches would be
+    targets = [0.95, 0.9, 0.85, 0.8, 0.75]
+    planted = [1500, 3, 999, 42, 1200]
+    for row, target in zip(planted, targets):
+        noise = rng.standard_normal(768).astype(np.float32)
+        noise -= (noise @ query) * query
+        noise /= np.linalg.norm(noise)
+        E[row] = target * query + np.sqrt(1 - target ** 2) * noise
+
+    exact = E @ query
+    E_i8, inv_scale = quantize_rows(E)
+    approx = score_int8_rows(E_i8, inv_scale, query)
+
+    assert np.max(np.abs(approx - exact)) < 2e-3
+    assert list(np.argsort(-approx)[:len(planted)]) == planted
+
+def test_int8_scores_cover_partial_last_chunk():
+    """Catalog sizes that aren't a multiple of the chunk size are scored in full."""
+    E = _normalized_rows(257)
+    E_i8, inv_scale = quantize_rows(E)
+    sims = score_int8_rows(E_i8, inv_scale, E[256])
+    assert sims.shape == (257,)
+    assert int(np.argmax(sims)) == 256
+
+def _rows_with_similarities(query: np.ndarray, similarities) -> np.ndarray:
+    """Build normalized rows whose dot product with the query is exactly each similarity."""
+    # An axis orthogonal to the query carries the remainder of each row's norm
+    other = np.zeros_like(query)
+    other[1] = 1.0
+    return np.stack([s * query + np.sqrt(1 - s ** 2) * other for s in similarities]).astype(np.float32)
+
+def test_search_returns_matches_most_similar_first():
+    query = np.zeros(768, dtype=np.float32)
+    query[0] = 1.0
+    E = _rows_with_similarities(query, [0.75, 0.9, 0.5, 0.8])
+
+    matches = search_embeddings(E, None, query, match_threshold=0.6, match_count=2)
+
+    assert [i for i, _ in matches] == [1, 3]
+    assert np.allclose([s for _, s in matches], [0.9, 0.8])
+
+def test_search_threshold_is_strict():
+    """Like the SQL function, a row scoring exactly the threshold is excluded."""
+    query = np.zeros(768, dtype=np.float32)
+    query[0] = 1.0
+    E = np.stack([query, -query])
+
+    assert search_embeddings(E, None, query, match_threshold=1.0, match_count=5) == []
+    assert [i for i, _ in search_embeddings(E, None, query, match_threshold=0.99, match_count=5)] == [0]
+
+def test_search_match_count_bounds():
+    query = np.zeros(768, dtype=np.float32)
+    query[0] = 1.0
+    E = _rows_with_similarities(query, [0.2, 0.6, 0.4])
+
+    # Asking for at least as many rows as exist returns every row above the threshold
+    assert [i for i, _ in search_embeddings(E, None, query, match_threshold=0.0, match_count=3)] == [1, 2, 0]
+    assert [i for i, _ in search_embeddings(E, None, query, match_threshold=0.0, match_count=10)] == [1, 2, 0]
+    assert search_embeddings(E, None, query, match_threshold=0.0, match_count=0) == []
+    assert search_embeddings(E, None, query, match_threshold=0.0, match_count=-1) == []
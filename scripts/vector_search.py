@@ -0,0 +1,59 @@
+import numpy as np
+from typing import List, Optional, Tuple
+
+# Rows widened to float32 at a time when scoring an int8 catalog; 256 x 768 float32
+# is ~0.75 MB, small enough to stay in L2 so only the int8 rows come from main memory
+SCORE_CHUNK_ROWS = 256
+
+def quantize_rows(E: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Quantize row-normalized embeddings to int8, returning the rows and their inverse scales."""
+    max_abs = np.max(np.abs(E), axis=1)
+    scale = 127.0 / np.where(max_abs > 0, max_abs, 1.0)
+    E_i8 = np.round(E * scale[:, None]).astype(np.int8)
+    return E_i8, (1.0 / scale).astype(np.float32)
+
+def score_int8_rows(E_i8: np.ndarray, inv_scale: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Dot every int8 row with a float32 query, widening one cache-sized chunk at a time."""
+    sims = np.empty(len(E_i8), dtype=np.float32)
+    for start in range(0, len(E_i8), SCORE_CHUNK_ROWS):
+        chunk = E_i8[start:start + SCORE_CHUNK_ROWS].astype(np.float32)
+        sims[start:start + SCORE_CHUNK_ROWS] = chunk @ query
+    sims *= inv_scale
+    return sims
+
+def search_embeddings(
+    E: np.ndarray,
+    inv_scale: Optional[np.ndarray],
+    query: np.ndarray,
+    match_threshold: float,
+    match_count: int
+) -> List[Tuple[int, float]]:
+    """
+    Find the rows most similar to a normalized query, like the match_disease_images RPC.
+    
+    Args:
+        E: Row-normalized embeddings, float32 or int8 from quantize_rows
+        inv_scale: Inverse row scales for an int8 E, or None for float32
+        query: Normalized query embedding
+        match_threshold: Only rows scoring strictly above this are returned
+        match_count: Maximum number of rows to return
+        
+    Returns:
+        (row index, similarity) pairs, most similar first
+    """
+    if len(E) == 0 or match_count <= 0:
+        return []
+
+    query = query.astype(np.float32)
+    if inv_scale is None:
+        sims = E @ query
+    else:
+        sims = score_int8_rows(E, inv_scale, query)
+
+    if match_count < len(sims):
+        idx = np.argpartition(-sims, match_count)[:match_count]
+    else:
+        idx = np.arange(len(sims))
+    idx = idx[np.argsort(-sims[idx])]
+
+    return [(int(i), float(sims[i])) for i in idx if sims[i] > match_threshold]
@@ -9,6 +9,7 @@ AS $$
   import sys
   import os
   import json
+  import asyncio
   
   # Add the scripts directory to the Python path
   sys.path.append(os.path.join(os.path.dirname(__file__), '../../scripts'))
@@ -17,7 +18,7 @@ AS $$
   from diagnose import diagnose_plant_disease as diagnose
   
   # Call the function and return the result as JSON
-  result = diagnose(image_url, top_k)
+  result = asyncio.run(diagnose(image_url, top_k))
   return json.dumps(result)
 $$;
 